@@ -1,14 +1,28 @@
 import asyncio
+import collections
 import collections.abc
 import functools
+import heapq
 import inspect
+import json
+import logging
+import gc
+import os
+import socket
+import sys
+import time
+import tracemalloc
+import types
 from typing import (
     Any,
     Awaitable,
     Callable,
     Dict,
+    FrozenSet,
     Hashable,
     Iterator,
+    List,
+    NamedTuple,
     Optional,
     Set,
     Tuple,
@@ -16,14 +30,44 @@ from typing import (
 )
 import uuid
 
-from aiohttp import web
+from aiohttp import WSCloseCode, WSMessage, WSMsgType, web
 import aiohttp_session
 
 __version__ = "1.1.1"
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_ID_FACTORY = lambda request: uuid.uuid4().hex
 DEFAULT_SESSION_KEY = "aiohttp_session_ws_id"
 REGISTRY_KEY = "aiohttp_session_ws_registry"
+HANDOFF_SERVER_KEY = "aiohttp_session_ws_handoff_server"
+DEFAULT_SNAPSHOT_CHUNK_SIZE = 500
+DEFAULT_RECEIVE_MANY_MAX = 100
+DEFAULT_MAX_QUEUED = 1000
+DEFAULT_HANDOFF_TTL = 60
+DEFAULT_HANDOFF_MAX_STATES = 10000
+DEFAULT_HANDOFF_TIMEOUT = 10
+
+STAGE_SESSION_LOAD = "session_load"
+STAGE_GENERATE_ID = "generate_id"
+STAGE_SAVE_SESSION = "save_session"
+STAGE_REGISTER = "register"
+STAGE_PREPARE = "prepare"
+STAGE_UNREGISTER = "unregister"
+
+_CLOSING_MSG_TYPES = frozenset(
+    [WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR]
+)
+_DATA_MSG_TYPES = frozenset([WSMsgType.TEXT, WSMsgType.BINARY])
+# WebSocketResponse defaults for registries in low-memory mode: no per-socket
+# compression context.
+LOW_MEMORY_WS_OPTIONS = {"compress": False}  # type: Dict[str, Any]
+# A precomputed websocket handshake key, for `measure_idle_websockets`.
+_HANDSHAKE_KEY = "dGhlIHNhbXBsZSBub25jZQ=="
+
+PRIORITY_CONTROL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
 
 
 async def get_session_ws_id(request: web.Request) -> Hashable:
@@ -78,9 +122,619 @@ async def session_ws_middleware(
     return await handler(request)
 
 
+class _SnapshotIterator:
+    """
+    Async iterator that yields a registry's (session_ws_id, wsrs) pairs in
+    chunks, yielding to the event loop between chunks.
+    """
+
+    __slots__ = ("registry", "chunk_size", "_keys", "_offset")
+
+    def __init__(self, registry: "SessionWSRegistry", chunk_size: int) -> None:
+        self.registry = registry
+        self.chunk_size = chunk_size
+        self._keys = None  # type: Optional[List[Hashable]]
+        self._offset = 0
+
+    def __aiter__(self) -> "_SnapshotIterator":
+        return self
+
+    async def __anext__(
+        self
+    ) -> List[Tuple[Hashable, FrozenSet[web.WebSocketResponse]]]:
+        if self._keys is None:
+            # copying the keys is cheap; the expensive part (the values) is
+            # copied lazily, chunk by chunk, as sessions come and go.
+            self._keys = list(self.registry._registry)
+        else:
+            await asyncio.sleep(0)
+
+        chunk = []
+        while not chunk and self._offset < len(self._keys):
+            keys = self._keys[self._offset : self._offset + self.chunk_size]
+            self._offset += len(keys)
+            for key in keys:
+                wsrs = self.registry._registry.get(key)
+                if wsrs:
+                    chunk.append((key, frozenset(wsrs)))
+
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+
+class _TrafficCounter:
+    __slots__ = (
+        "messages_in",
+        "bytes_in",
+        "messages_out",
+        "bytes_out",
+        "dropped",
+        "error",
+    )
+
+    def __init__(self, error: int = 0) -> None:
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        # the weight of the evicted counter this one replaced: an upper bound
+        # on the traffic it may have missed
+        self.error = error
+
+    @property
+    def weight(self) -> int:
+        # as in Space-Saving, a counter starts at the weight it replaced
+        return self.error + self.bytes_in + self.bytes_out
+
+
+class _TrafficBucket:
+    """
+    At most ``capacity`` counters, kept with the Space-Saving algorithm.
+    """
+
+    __slots__ = ("index", "counters", "_heap", "_seq")
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.counters = {}  # type: Dict[Hashable, _TrafficCounter]
+        # (weight, seq, session_ws_id): a min-heap with one entry per counter,
+        # whose weight may be stale (counters only grow)
+        self._heap = []  # type: List[Tuple[int, int, Hashable]]
+        self._seq = 0
+
+    def counter(
+        self, session_ws_id: Hashable, capacity: int
+    ) -> _TrafficCounter:
+        counter = self.counters.get(session_ws_id)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= capacity:
+                error = self._evict()
+            counter = self.counters[session_ws_id] = _TrafficCounter(error)
+            self._push(session_ws_id, counter)
+        return counter
+
+    def _push(self, session_ws_id: Hashable, counter: _TrafficCounter) -> None:
+        self._seq += 1
+        heapq.heappush(self._heap, (counter.weight, self._seq, session_ws_id))
+
+    def _evict(self) -> int:
+        """
+        Remove the counter with the least weight, returning its weight.
+        """
+        while True:
+            weight, _, session_ws_id = heapq.heappop(self._heap)
+            counter = self.counters[session_ws_id]
+            if counter.weight == weight:
+                del self.counters[session_ws_id]
+                return weight
+            self._push(session_ws_id, counter)  # stale: re-file it
+
+
+class TrafficAccounting:
+    """
+    Approximate, memory-bounded traffic counters per session_ws id.
+
+    Traffic is counted in ``buckets`` buckets of ``bucket_seconds`` each (so
+    queries cover the last ``buckets * bucket_seconds`` seconds). Each bucket
+    keeps at most ``capacity`` counters with the Space-Saving algorithm: when
+    full, the session with the least traffic (in bytes) is evicted to make
+    room, and the newcomer starts from the evicted session's traffic (reported
+    as its ``error``), so sessions with heavy traffic stay.
+
+    Counts are exact from when a session got its counter; ``error`` bounds
+    the traffic it may have had before. String messages are counted by their
+    UTF-8 encoded length.
+    """
+
+    METRICS = frozenset(
+        [
+            "messages_in",
+            "bytes_in",
+            "messages_out",
+            "bytes_out",
+            "dropped",
+            "messages",
+            "bytes",
+        ]
+    )
+
+    def __init__(
+        self,
+        *,
+        bucket_seconds: float = 60,
+        buckets: int = 10,
+        capacity: int = 1000
+    ) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.capacity = capacity
+        # oldest first
+        self._buckets = collections.deque(maxlen=buckets)
+
+    def _bucket_index(self) -> int:
+        return int(time.monotonic() // self.bucket_seconds)
+
+    def _counter(self, session_ws_id: Hashable) -> _TrafficCounter:
+        index = self._bucket_index()
+        if not self._buckets or self._buckets[-1].index != index:
+            self._buckets.append(_TrafficBucket(index))
+        return self._buckets[-1].counter(session_ws_id, self.capacity)
+
+    def record_in(
+        self, session_ws_id: Hashable, messages: int, nbytes: int
+    ) -> None:
+        counter = self._counter(session_ws_id)
+        counter.messages_in += messages
+        counter.bytes_in += nbytes
+
+    def record_out(
+        self, session_ws_id: Hashable, messages: int, nbytes: int
+    ) -> None:
+        counter = self._counter(session_ws_id)
+        counter.messages_out += messages
+        counter.bytes_out += nbytes
+
+    def record_dropped(self, session_ws_id: Hashable, messages: int) -> None:
+        self._counter(session_ws_id).dropped += messages
+
+    def top(self, n: int = 10, metric: str = "bytes") -> List[Dict[str, Any]]:
+        """
+        The ``n`` sessions with the most traffic over the retained buckets,
+        by ``metric`` (one of ``METRICS``; ``messages`` and ``bytes`` are the
+        sums of both directions).
+        """
+        if metric not in self.METRICS:
+            raise ValueError("Unknown metric: {!r}".format(metric))
+
+        oldest = self._bucket_index() - self.buckets + 1
+        totals = {}  # type: Dict[Hashable, Dict[str, Any]]
+        for bucket in self._buckets:
+            if bucket.index < oldest:
+                continue
+            for session_ws_id, counter in bucket.counters.items():
+                total = totals.get(session_ws_id)
+                if total is None:
+                    total = totals[session_ws_id] = {
+                        "session_ws_id": session_ws_id,
+                        "messages_in": 0,
+                        "bytes_in": 0,
+                        "messages_out": 0,
+                        "bytes_out": 0,
+                        "dropped": 0,
+                        "error": 0,
+                    }
+                for name in _TrafficCounter.__slots__:
+                    total[name] += getattr(counter, name)
+
+        for total in totals.values():
+            total["messages"] = total["messages_in"] + total["messages_out"]
+            total["bytes"] = total["bytes_in"] + total["bytes_out"]
+        return heapq.nlargest(
+            n, totals.values(), key=lambda total: total[metric]
+        )
+
+
+class _SendScheduler:
+    """
+    Sends queued messages to websockets, with a writer task per websocket (so
+    a slow client only holds up its own messages).
+
+    Each websocket's messages with a lower priority are sent first. At most
+    ``max_queued`` messages are queued per websocket: beyond that, its oldest
+    message of the lowest priority (e.g. bulk data) is dropped.
+    """
+
+    __slots__ = ("traffic", "max_queued", "_queues", "_tasks")
+
+    def __init__(
+        self,
+        traffic: Optional[TrafficAccounting] = None,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+    ) -> None:
+        self.traffic = traffic
+        self.max_queued = max_queued
+        # wsr -> one queue of pending (session_ws_id, data) per priority
+        self._queues = {}  # type: Dict[Any, List[collections.deque]]
+        # wsr -> its writer task
+        self._tasks = {}  # type: Dict[Any, asyncio.Future]
+
+    def __len__(self) -> int:
+        return sum(
+            len(queue) for queues in self._queues.values() for queue in queues
+        )
+
+    def enqueue(
+        self,
+        wsr: web.WebSocketResponse,
+        session_ws_id: Hashable,
+        data: Any,
+        priority: int,
+    ) -> None:
+        queues = self._queues.get(wsr)
+        if queues is None:
+            queues = self._queues[wsr] = [
+                collections.deque() for i in range(PRIORITY_BULK + 1)
+            ]
+        queues[priority].append((session_ws_id, data))
+        if sum(len(queue) for queue in queues) > self.max_queued:
+            queue = next(queue for queue in reversed(queues) if queue)
+            dropped_id, _ = queue.popleft()
+            if self.traffic is not None:
+                self.traffic.record_dropped(dropped_id, 1)
+
+        if wsr not in self._tasks:
+            self._tasks[wsr] = asyncio.ensure_future(self._run(wsr))
+
+    def discard(self, wsr: web.WebSocketResponse) -> int:
+        """
+        Drop the pending data of a wsr, returning the number of messages
+        dropped. Its writer stops after any send in progress.
+        """
+        queues = self._queues.pop(wsr, None)
+        if queues is None:
+            return 0
+        if self.traffic is not None:
+            for queue in queues:
+                for session_ws_id, _ in queue:
+                    self.traffic.record_dropped(session_ws_id, 1)
+        return sum(len(queue) for queue in queues)
+
+    def _next(
+        self, wsr: web.WebSocketResponse
+    ) -> Optional[Tuple[Hashable, Any]]:
+        queues = self._queues.get(wsr)
+        if queues is None:
+            return None
+        for queue in queues:
+            if queue:
+                item = queue.popleft()
+                if not any(queues):
+                    del self._queues[wsr]
+                return item
+        return None
+
+    async def _run(self, wsr: web.WebSocketResponse) -> None:
+        try:
+            while True:
+                item = self._next(wsr)
+                if item is None:
+                    return
+                session_ws_id, data = item
+                if wsr.closed:
+                    self._drop(wsr, session_ws_id)
+                    continue
+                try:
+                    await self._send(wsr, data)
+                except (ConnectionError, RuntimeError):
+                    self._drop(wsr, session_ws_id)
+                except Exception:  # pylint: disable=W0703, broad-except
+                    # e.g. data that isn't JSON-serializable: skip the message
+                    logger.exception(
+                        "Failed to send to session_ws id %r", session_ws_id
+                    )
+                    if self.traffic is not None:
+                        self.traffic.record_dropped(session_ws_id, 1)
+        finally:
+            self._tasks.pop(wsr, None)
+
+    def _drop(
+        self, wsr: web.WebSocketResponse, session_ws_id: Hashable
+    ) -> None:
+        if self.traffic is not None:
+            self.traffic.record_dropped(session_ws_id, 1)
+        self.discard(wsr)
+
+    @staticmethod
+    async def _send(wsr: web.WebSocketResponse, data: Any) -> None:
+        if isinstance(data, str):
+            await wsr.send_str(data)
+        elif isinstance(data, bytes):
+            await wsr.send_bytes(data)
+        else:
+            await wsr.send_json(data)
+
+
+TraceUpgradeParams = NamedTuple(
+    "TraceUpgradeParams",
+    [
+        ("request", web.Request),
+        ("session_ws_id", Hashable),
+        ("response", web.WebSocketResponse),
+    ],
+)
+TraceUpgradeExceptionParams = NamedTuple(
+    "TraceUpgradeExceptionParams",
+    [
+        ("request", web.Request),
+        ("session_ws_id", Hashable),
+        ("response", web.WebSocketResponse),
+        ("exception", BaseException),
+    ],
+)
+TraceStageParams = NamedTuple(
+    "TraceStageParams",
+    [("stage", str), ("request", web.Request), ("session_ws_id", Hashable)],
+)
+TraceCloseAllSessionParams = NamedTuple(
+    "TraceCloseAllSessionParams",
+    [("session_ws_id", Hashable), ("sockets", int)],
+)
+TraceScheduleCloseAllSessionParams = NamedTuple(
+    "TraceScheduleCloseAllSessionParams",
+    [("request", web.Request), ("session_ws_id", Hashable)],
+)
+
+
+class _TraceSignal(list):
+    async def send(self, *args: Any) -> None:
+        for receiver in self:
+            await receiver(*args)
+
+
+class SessionWSTraceConfig:
+    """
+    Tracing hooks for `session_ws` and `SessionWSRegistry`, in the style of
+    aiohttp.TraceConfig.
+
+    Append coroutines to the signals; they're called with the registry, the
+    trace_config_ctx (shared by the callbacks of one operation) and params.
+    `on_stage_start` and `on_stage_end` are sent around each step of
+    `session_ws` (see the ``STAGE_*`` constants). If a step raises,
+    `on_upgrade_exception` is sent instead of the remaining signals.
+    """
+
+    def __init__(
+        self,
+        trace_config_ctx_factory: Callable[[], Any] = types.SimpleNamespace,
+    ) -> None:
+        self.trace_config_ctx_factory = trace_config_ctx_factory
+        self.on_upgrade_start = _TraceSignal()
+        self.on_upgrade_end = _TraceSignal()
+        self.on_upgrade_exception = _TraceSignal()
+        self.on_stage_start = _TraceSignal()
+        self.on_stage_end = _TraceSignal()
+        self.on_close_all_session_start = _TraceSignal()
+        self.on_close_all_session_end = _TraceSignal()
+        self.on_schedule_close_all_session = _TraceSignal()
+
+    def trace_config_ctx(self) -> Any:
+        return self.trace_config_ctx_factory()
+
+
+class _Trace:
+    """
+    Sends the signals of one trace config for one traced operation.
+    """
+
+    __slots__ = ("registry", "trace_config", "trace_config_ctx")
+
+    def __init__(
+        self, registry: "SessionWSRegistry", trace_config: SessionWSTraceConfig
+    ) -> None:
+        self.registry = registry
+        self.trace_config = trace_config
+        self.trace_config_ctx = trace_config.trace_config_ctx()
+
+    async def send_upgrade_start(
+        self,
+        request: web.Request,
+        session_ws_id: Hashable,
+        response: web.WebSocketResponse,
+    ) -> None:
+        await self.trace_config.on_upgrade_start.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceUpgradeParams(request, session_ws_id, response),
+        )
+
+    async def send_upgrade_end(
+        self,
+        request: web.Request,
+        session_ws_id: Hashable,
+        response: web.WebSocketResponse,
+    ) -> None:
+        await self.trace_config.on_upgrade_end.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceUpgradeParams(request, session_ws_id, response),
+        )
+
+    async def send_upgrade_exception(
+        self,
+        request: web.Request,
+        session_ws_id: Hashable,
+        response: web.WebSocketResponse,
+        exception: BaseException,
+    ) -> None:
+        await self.trace_config.on_upgrade_exception.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceUpgradeExceptionParams(
+                request, session_ws_id, response, exception
+            ),
+        )
+
+    async def send_stage_start(
+        self, stage: str, request: web.Request, session_ws_id: Hashable
+    ) -> None:
+        await self.trace_config.on_stage_start.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceStageParams(stage, request, session_ws_id),
+        )
+
+    async def send_stage_end(
+        self, stage: str, request: web.Request, session_ws_id: Hashable
+    ) -> None:
+        await self.trace_config.on_stage_end.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceStageParams(stage, request, session_ws_id),
+        )
+
+    async def send_close_all_session_start(
+        self, session_ws_id: Hashable, sockets: int
+    ) -> None:
+        await self.trace_config.on_close_all_session_start.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceCloseAllSessionParams(session_ws_id, sockets),
+        )
+
+    async def send_close_all_session_end(
+        self, session_ws_id: Hashable, sockets: int
+    ) -> None:
+        await self.trace_config.on_close_all_session_end.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceCloseAllSessionParams(session_ws_id, sockets),
+        )
+
+    async def send_schedule_close_all_session(
+        self, request: web.Request, session_ws_id: Hashable
+    ) -> None:
+        await self.trace_config.on_schedule_close_all_session.send(
+            self.registry,
+            self.trace_config_ctx,
+            TraceScheduleCloseAllSessionParams(request, session_ws_id),
+        )
+
+
+# The traces of operations when tracing is disabled, shared to avoid
+# allocating for every connection.
+_NO_TRACES = ()  # type: Tuple[_Trace, ...]
+
+
+class SlowUpgradeSampler:
+    """
+    Logs `session_ws` upgrades (successful or not) that take at least
+    ``threshold`` seconds, along with the time spent in each stage.
+
+    Use it by adding its ``trace_config`` to the registry's ``trace_configs``.
+    """
+
+    def __init__(
+        self, threshold: float, *, log: Optional[logging.Logger] = None
+    ) -> None:
+        self.threshold = threshold
+        self.log = log or logger
+        self.trace_config = SessionWSTraceConfig()
+        self.trace_config.on_upgrade_start.append(self.on_upgrade_start)
+        self.trace_config.on_stage_start.append(self.on_stage_start)
+        self.trace_config.on_stage_end.append(self.on_stage_end)
+        self.trace_config.on_upgrade_end.append(self.on_upgrade_end)
+        self.trace_config.on_upgrade_exception.append(
+            self.on_upgrade_exception
+        )
+
+    async def on_upgrade_start(
+        self, registry: "SessionWSRegistry", ctx: Any, params: Any
+    ) -> None:
+        # pylint: disable=W0613, unused-argument
+        ctx.start = time.monotonic()
+        ctx.stages = []
+
+    async def on_stage_start(
+        self, registry: "SessionWSRegistry", ctx: Any, params: Any
+    ) -> None:
+        # pylint: disable=W0613, unused-argument
+        ctx.stage = params.stage
+        ctx.stage_start = time.monotonic()
+
+    async def on_stage_end(
+        self, registry: "SessionWSRegistry", ctx: Any, params: Any
+    ) -> None:
+        # pylint: disable=W0613, unused-argument
+        if hasattr(ctx, "stages"):
+            ctx.stages.append(
+                (params.stage, time.monotonic() - ctx.stage_start)
+            )
+            ctx.stage = None
+
+    async def on_upgrade_end(
+        self, registry: "SessionWSRegistry", ctx: Any, params: Any
+    ) -> None:
+        # pylint: disable=W0613, unused-argument
+        self._log(ctx, params, "Slow session_ws upgrade")
+
+    async def on_upgrade_exception(
+        self, registry: "SessionWSRegistry", ctx: Any, params: Any
+    ) -> None:
+        # pylint: disable=W0613, unused-argument
+        if getattr(ctx, "stage", None) is not None:
+            ctx.stages.append(
+                (
+                    "{} (failed)".format(ctx.stage),
+                    time.monotonic() - ctx.stage_start,
+                )
+            )
+        self._log(
+            ctx,
+            params,
+            "Slow session_ws upgrade failed with {!r}".format(
+                params.exception
+            ),
+        )
+
+    def _log(self, ctx: Any, params: Any, message: str) -> None:
+        elapsed = time.monotonic() - ctx.start
+        if elapsed >= self.threshold:
+            self.log.warning(
+                "%s (%.3fs) for session_ws id %r: %s",
+                message,
+                elapsed,
+                params.session_ws_id,
+                ", ".join(
+                    "{}={:.3f}s".format(stage, duration)
+                    for stage, duration in ctx.stages
+                ),
+            )
+
+
 class SessionWSRegistry(collections.abc.Mapping):
     """
     Stores and manages a set of WebSocketResponses by session_ws id
+
+    In ``low_memory`` mode, the websockets of a session share one copy of its
+    session_ws id (the registry's key), registration times aren't recorded
+    (so `summary` omits the oldest websockets), and `session_ws` defaults to
+    `LOW_MEMORY_WS_OPTIONS`, to reduce the footprint of idle websockets.
+
+    ``trace_configs`` is a list of `SessionWSTraceConfig`s to send tracing
+    signals to.
+
+    With ``traffic`` (a `TrafficAccounting`), traffic is counted per session:
+    data sent and received by websockets of `session_ws`, and data dropped by
+    `schedule_send`.
+
+    ``max_queued`` bounds the data `schedule_send` queues per websocket.
+
+    States handed off to this registry (see `serve_handoff`) are kept for
+    ``handoff_ttl`` seconds, and at most ``handoff_max_states`` of them (the
+    oldest are dropped first).
     """
 
     def __init__(
@@ -90,11 +744,28 @@ class SessionWSRegistry(collections.abc.Mapping):
             Callable[[web.Request], Hashable],
             Callable[[web.Request], Awaitable[Hashable]],
         ] = DEFAULT_ID_FACTORY,
-        session_key: Hashable = DEFAULT_SESSION_KEY
+        session_key: Hashable = DEFAULT_SESSION_KEY,
+        low_memory: bool = False,
+        trace_configs: Optional[List[SessionWSTraceConfig]] = None,
+        traffic: Optional[TrafficAccounting] = None,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        handoff_ttl: float = DEFAULT_HANDOFF_TTL,
+        handoff_max_states: int = DEFAULT_HANDOFF_MAX_STATES
     ):
         self._registry = {}  # type: Dict[str, Set[web.WebSocketResponse]]
+        self._registered_at = {}  # type: Dict[web.WebSocketResponse, float]
+        self._ids = {}  # type: Dict[Hashable, Hashable]
+        self._scheduler = _SendScheduler(traffic, max_queued)
         self.id_factory = id_factory
         self.session_key = session_key
+        self.low_memory = low_memory
+        self.trace_configs = list(trace_configs or ())
+        self.traffic = traffic
+        self.draining = False
+        # session_ws_id -> (expiry, state), oldest first
+        self._handoff_state = collections.OrderedDict()
+        self.handoff_ttl = handoff_ttl
+        self.handoff_max_states = handoff_max_states
 
     def __getitem__(self, key: str) -> Set[web.WebSocketResponse]:
         return self._registry[key]
@@ -105,6 +776,119 @@ class SessionWSRegistry(collections.abc.Mapping):
     def __len__(self) -> int:
         return len(self._registry)
 
+    def iter_snapshot(
+        self, *, chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE
+    ) -> _SnapshotIterator:
+        """
+        Iterate over chunks of (session_ws_id, frozenset of wsrs) pairs,
+        yielding to the event loop between chunks. Safe to use while
+        websockets register and unregister.
+        """
+        return _SnapshotIterator(self, chunk_size)
+
+    async def snapshot(
+        self, *, chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE
+    ) -> Dict[Hashable, FrozenSet[web.WebSocketResponse]]:
+        """
+        Copy the registry without blocking the event loop for large registries.
+        """
+        result = {}  # type: Dict[Hashable, FrozenSet[web.WebSocketResponse]]
+        async for chunk in self.iter_snapshot(chunk_size=chunk_size):
+            result.update(chunk)
+        return result
+
+    async def summary(
+        self,
+        *,
+        chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE,
+        oldest: int = 5
+    ) -> Dict[str, Any]:
+        """
+        Aggregate counts of the registry: the number of sessions and sockets,
+        a histogram of sockets per session, and the ``oldest`` registered
+        sockets (as ``session_ws_id`` and ``age`` in seconds).
+        """
+        sessions = sockets = 0
+        histogram = collections.Counter()  # type: collections.Counter
+        candidates = []  # type: List[Tuple[float, Hashable]]
+        async for chunk in self.iter_snapshot(chunk_size=chunk_size):
+            for session_ws_id, wsrs in chunk:
+                sessions += 1
+                sockets += len(wsrs)
+                histogram[len(wsrs)] += 1
+                for wsr in wsrs:
+                    registered_at = self._registered_at.get(wsr)
+                    if registered_at is not None:
+                        candidates.append((registered_at, session_ws_id))
+            candidates = heapq.nsmallest(
+                oldest, candidates, key=lambda item: item[0]
+            )
+
+        now = time.monotonic()
+        return {
+            "sessions": sessions,
+            "sockets": sockets,
+            "histogram": dict(sorted(histogram.items())),
+            "oldest": [
+                {"session_ws_id": session_ws_id, "age": now - registered_at}
+                for registered_at, session_ws_id in candidates
+            ],
+        }
+
+    async def footprint(
+        self, *, chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE
+    ) -> Dict[str, Any]:
+        """
+        Shallowly measure the memory (in bytes) the registry, its websockets
+        and their `session_ws` context managers hold.
+
+        This is a lower bound: websockets are measured without their reader,
+        parser, writer, transport, etc. (where most of an idle websocket's
+        memory goes). Use `measure_idle_websockets` for the full cost of a
+        connection.
+        """
+        registry_bytes = (
+            sys.getsizeof(self._registry)
+            + sys.getsizeof(self._registered_at)
+            + sys.getsizeof(self._ids)
+        )
+        wsr_bytes = sockets = 0
+        async for chunk in self.iter_snapshot(chunk_size=chunk_size):
+            for session_ws_id, wsrs in chunk:
+                registry_bytes += sys.getsizeof(session_ws_id) + sys.getsizeof(
+                    self._registry.get(session_ws_id)
+                )
+                for wsr in wsrs:
+                    sockets += 1
+                    if wsr in self._registered_at:
+                        registry_bytes += sys.getsizeof(
+                            self._registered_at[wsr]
+                        )
+                    wsr_bytes += sys.getsizeof(wsr)
+                    if hasattr(wsr, "__dict__"):
+                        wsr_bytes += sys.getsizeof(wsr.__dict__)
+
+        session_ws_bytes = sockets * sys.getsizeof(
+            session_ws.__new__(session_ws)
+        )
+        total = registry_bytes + wsr_bytes + session_ws_bytes
+        return {
+            "sockets": sockets,
+            "registry_bytes": registry_bytes,
+            "shallow_wsr_bytes": wsr_bytes,
+            "session_ws_bytes": session_ws_bytes,
+            "shallow_bytes_per_socket": total / sockets if sockets else 0,
+        }
+
+    def make_traces(self) -> Tuple[_Trace, ...]:
+        """
+        Make the traces for one operation.
+
+        Callers skip this when tracing is disabled (no ``trace_configs``),
+        using the shared, empty `_NO_TRACES` instead.
+        """
+        return tuple(_Trace(self, config) for config in self.trace_configs)
+
     async def generate_id(self, request: web.Request) -> Hashable:
         result = self.id_factory(request)
         return await result if inspect.isawaitable(result) else result
@@ -142,6 +926,8 @@ class SessionWSRegistry(collections.abc.Mapping):
         Close all known websockets.
         """
         wsrs = set().union(*self.values())
+        for wsr in wsrs:
+            self._scheduler.discard(wsr)
         await asyncio.gather(*[wsr.close() for wsr in wsrs])
 
     async def close_all_session(self, session_ws_id: Hashable) -> None:
@@ -150,10 +936,203 @@ class SessionWSRegistry(collections.abc.Mapping):
         Unlike `schedule_close_all_session`, `close_all_session` takes an id,
         because the request might have a new session_ws id by the time it
         arrives here.
+
+        Data queued with `schedule_send` for these websockets is dropped, so
+        the close isn't held up behind it.
         """
         wsrs = self.get(session_ws_id, set())
+        sockets = len(wsrs)
+        traces = self.make_traces() if self.trace_configs else _NO_TRACES
+        for trace in traces:
+            await trace.send_close_all_session_start(session_ws_id, sockets)
+
+        for wsr in wsrs:
+            self._scheduler.discard(wsr)
         await asyncio.gather(*[wsr.close() for wsr in wsrs])
 
+        for trace in traces:
+            await trace.send_close_all_session_end(session_ws_id, sockets)
+
+    async def drain(
+        self,
+        *,
+        resume: Optional[str] = None,
+        code: int = WSCloseCode.SERVICE_RESTART,
+        handoff_path: Optional[str] = None,
+        get_state: Optional[
+            Union[
+                Callable[[Hashable], Any], Callable[[Hashable], Awaitable[Any]]
+            ]
+        ] = None,
+        handoff_timeout: float = DEFAULT_HANDOFF_TIMEOUT
+    ) -> None:
+        """
+        Drain the registry ahead of a restart: `session_ws` stops accepting
+        websockets, the state of each session (from ``get_state``) is handed
+        over to the worker listening on the unix socket at ``handoff_path``
+        (see `serve_handoff`), and all websockets are closed with ``code``.
+
+        ``resume`` is sent as the close message, telling clients where (or
+        with what token) to reconnect. It must encode to 123 bytes or less.
+
+        If the handoff fails (e.g. there's no successor listening) or takes
+        longer than ``handoff_timeout`` seconds, it's logged, and the
+        websockets are closed regardless.
+        """
+        message = (resume or "").encode()
+        if len(message) > 123:
+            raise ValueError("resume must encode to 123 bytes or less")
+        self.draining = True
+
+        try:
+            if handoff_path is not None and get_state is not None:
+                states = {}  # type: Dict[Hashable, Any]
+                async for chunk in self.iter_snapshot():
+                    for session_ws_id, _ in chunk:
+                        state = get_state(session_ws_id)
+                        if inspect.isawaitable(state):
+                            state = await state
+                        if state is not None:
+                            states[session_ws_id] = state
+                await self.handoff(
+                    handoff_path, states, timeout=handoff_timeout
+                )
+        except Exception:  # pylint: disable=W0703, broad-except
+            logger.exception("Failed to hand off session states")
+        finally:
+            wsrs = set().union(*self.values())
+            for wsr in wsrs:
+                self._scheduler.discard(wsr)
+            await asyncio.gather(
+                *[wsr.close(code=code, message=message) for wsr in wsrs]
+            )
+
+    async def handoff(
+        self,
+        path: str,
+        states: Dict[Hashable, Any],
+        *,
+        timeout: float = DEFAULT_HANDOFF_TIMEOUT
+    ) -> None:
+        """
+        Send session states to the worker listening on the unix socket at
+        ``path``, and wait for it to acknowledge them. Session_ws ids and
+        states must be JSON-serializable.
+
+        Raises ConnectionError if the successor doesn't acknowledge every
+        state, and asyncio.TimeoutError if it takes longer than ``timeout``
+        seconds.
+        """
+        ack = await asyncio.wait_for(self._send_handoff(path, states), timeout)
+        if ack != "{}\n".format(len(states)).encode():
+            raise ConnectionError(
+                "Handoff of {} states not acknowledged (got {!r})".format(
+                    len(states), ack
+                )
+            )
+
+    @staticmethod
+    async def _send_handoff(path: str, states: Dict[Hashable, Any]) -> bytes:
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            for session_ws_id, state in states.items():
+                record = {"session_ws_id": session_ws_id, "state": state}
+                writer.write(json.dumps(record).encode() + b"\n")
+            writer.write_eof()
+            # the successor replies with the number of states it stored
+            return await reader.readline()
+        finally:
+            await _close_writer(writer)
+
+    async def serve_handoff(
+        self, path: str, *, mode: int = 0o600
+    ) -> asyncio.AbstractServer:
+        """
+        Listen on the unix socket at ``path`` for session states handed off
+        by a draining worker. Retrieve them with `pop_handoff_state`.
+
+        Any process that can connect to the socket can hand off states: it's
+        created with the permissions ``mode`` (by default, only the owner can
+        connect).
+        """
+        async def on_connection(
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        ) -> None:
+            count = 0
+            try:
+                async for line in reader:
+                    record = json.loads(line.decode())
+                    self._store_handoff_state(
+                        record["session_ws_id"], record["state"]
+                    )
+                    count += 1
+                writer.write("{}\n".format(count).encode())
+                await writer.drain()
+            except Exception:  # pylint: disable=W0703, broad-except
+                logger.exception("Failed to receive handed off states")
+            finally:
+                await _close_writer(writer)
+
+        # bind under a restrictive umask, so the socket is never accessible
+        # with looser permissions than ``mode``
+        umask = os.umask(0o777 & ~mode)
+        try:
+            return await asyncio.start_unix_server(on_connection, path)
+        finally:
+            os.umask(umask)
+
+    def _store_handoff_state(self, session_ws_id: Hashable, state: Any) -> None:
+        now = time.monotonic()
+        self._handoff_state.pop(session_ws_id, None)
+        self._handoff_state[session_ws_id] = (now + self.handoff_ttl, state)
+        # states are ordered by expiry, so expired states are at the front
+        while self._handoff_state and (
+            len(self._handoff_state) > self.handoff_max_states
+            or next(iter(self._handoff_state.values()))[0] <= now
+        ):
+            self._handoff_state.popitem(last=False)
+
+    def pop_handoff_state(
+        self, session_ws_id: Hashable, default: Any = None
+    ) -> Any:
+        """
+        Remove and return the state handed off for this session (if any, and
+        if it hasn't expired).
+        """
+        item = self._handoff_state.pop(session_ws_id, None)
+        if item is None or item[0] <= time.monotonic():
+            return default
+        return item[1]
+
+    def schedule_send(
+        self,
+        session_ws_id: Hashable,
+        data: Any,
+        *,
+        priority: int = PRIORITY_NORMAL
+    ) -> None:
+        """
+        Queues data for all websockets that share this session. Strings are
+        sent with `send_str`, bytes with `send_bytes`, and anything else with
+        `send_json`.
+
+        Each websocket has its own writer, so a slow client doesn't hold up
+        the others. A websocket's `PRIORITY_CONTROL` data goes out before its
+        `PRIORITY_NORMAL` data, which goes out before its `PRIORITY_BULK`
+        data. Data that fails to send (e.g. isn't JSON-serializable) is
+        logged and skipped.
+
+        When a websocket has more than ``max_queued`` messages queued, its
+        oldest message of the lowest priority is dropped.
+        """
+        if (
+            not isinstance(priority, int)
+            or not PRIORITY_CONTROL <= priority <= PRIORITY_BULK
+        ):
+            raise ValueError("Unknown priority: {!r}".format(priority))
+        for wsr in self.get(session_ws_id, ()):
+            self._scheduler.enqueue(wsr, session_ws_id, data, priority)
+
     async def schedule_close_all_session(
         self, request: web.Request, response: Union[web.Response, web.HTTPFound]
     ) -> None:
@@ -171,14 +1150,25 @@ class SessionWSRegistry(collections.abc.Mapping):
         asyncio.ensure_future(onclose())
         response.force_close()
 
+        if self.trace_configs:
+            for trace in self.make_traces():
+                await trace.send_schedule_close_all_session(request, id_)
+
     def register(
         self, session_ws_id: Hashable, wsr: web.WebSocketResponse
-    ) -> None:
+    ) -> Hashable:
         """
-        Adds the session_ws_id, wsr pair to the registry.
+        Adds the session_ws_id, wsr pair to the registry, and returns the
+        session_ws_id to hold on to: in low-memory mode, the registry's own
+        key, so websockets of a session share a single copy of the id.
         """
+        if self.low_memory:
+            session_ws_id = self._ids.setdefault(session_ws_id, session_ws_id)
         wsrs = self._registry.setdefault(session_ws_id, set())
         wsrs.add(wsr)
+        if not self.low_memory:
+            self._registered_at.setdefault(wsr, time.monotonic())
+        return session_ws_id
 
     def unregister(
         self, session_ws_id: Hashable, wsr: web.WebSocketResponse
@@ -190,23 +1180,259 @@ class SessionWSRegistry(collections.abc.Mapping):
         """
         if session_ws_id not in self._registry:
             return
+        self._registered_at.pop(wsr, None)
+        self._scheduler.discard(wsr)
         if self._registry[session_ws_id] == set([wsr]):
             del self._registry[session_ws_id]
+            self._ids.pop(session_ws_id, None)
         else:
             self._registry[session_ws_id].remove(wsr)
 
 
-def setup(app: web.Application, registry: SessionWSRegistry) -> None:
+async def _close_writer(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    if hasattr(writer, "wait_closed"):  # Python 3.7+
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+def _has_buffered_data(wsr: web.WebSocketResponse) -> bool:
+    """
+    Whether the next frame buffered by the wsr's reader is a data frame, which
+    `receive` returns without waiting. `receive` handles control frames
+    itself (e.g. answering a PING) and then waits for the next frame.
+    """
+    buffer = getattr(wsr._reader, "_buffer", None)
+    if not buffer:
+        return False
+    msg, _ = buffer[0]  # the reader buffers (message, size) pairs
+    return msg.type in _DATA_MSG_TYPES
+
+
+def decode_json_batch(messages: List[WSMessage]) -> List[Any]:
+    """
+    A `session_ws.batches` decoder that parses each message of a batch as
+    JSON. A message that can't be decoded doesn't fail the batch: its
+    ValueError (e.g. json.JSONDecodeError or UnicodeDecodeError) takes its
+    place in the result.
+    """
+    result = []  # type: List[Any]
+    for msg in messages:
+        try:
+            data = msg.data
+            result.append(
+                json.loads(data if isinstance(data, str) else data.decode())
+            )
+        except ValueError as exc:
+            result.append(exc)
+    return result
+
+
+class _BatchIterator:
+    """
+    Async iterator over batches of messages received by a `session_ws`.
+    Stops when the websocket closes, or raises the websocket's exception when
+    it fails (a ``WSMsgType.ERROR`` message), after the messages before it.
+    """
+
+    __slots__ = ("session_ws", "max", "decoder", "timeout", "_closed", "_error")
+
+    def __init__(
+        self,
+        session_ws_: "session_ws",
+        max_: int,
+        decoder: Optional[Callable[[List[WSMessage]], Any]],
+        timeout: Optional[float],
+    ) -> None:
+        self.session_ws = session_ws_
+        self.max = max_
+        self.decoder = decoder
+        self.timeout = timeout
+        self._closed = False
+        self._error = None  # type: Optional[BaseException]
+
+    def __aiter__(self) -> "_BatchIterator":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._closed:
+            error, self._error = self._error, None
+            if error is not None:
+                raise error
+            raise StopAsyncIteration
+
+        messages = await self.session_ws.receive_many(
+            self.max, timeout=self.timeout
+        )
+        if messages[-1].type in _CLOSING_MSG_TYPES:
+            self._closed = True
+            msg = messages.pop()
+            if msg.type == WSMsgType.ERROR:
+                self._error = self.session_ws.response.exception() or msg.data
+            if not messages:
+                return await self.__anext__()
+        return self.decoder(messages) if self.decoder else messages
+
+
+async def measure_idle_websockets(
+    host: str,
+    port: int,
+    path: str = "/",
+    *,
+    connections: int = 100,
+    settle: float = 0.1
+) -> float:
+    """
+    Measure the memory (in bytes) an idle websocket costs a server running in
+    this process and event loop, e.g. an `aiohttp.test_utils.TestServer`.
+
+    Opens ``connections`` websockets to ``path``, waits ``settle`` seconds,
+    and diffs `tracemalloc` snapshots taken before and after. The clients are
+    plain sockets created before the first snapshot, so (nearly) all that's
+    measured is the server's side of the connections.
+    """
+    loop = asyncio.get_event_loop()
+    request = (
+        "GET {} HTTP/1.1\r\n"
+        "Host: {}:{}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        "Sec-WebSocket-Key: {}\r\n"
+        "Sec-WebSocket-Version: 13\r\n"
+        "\r\n"
+    ).format(path, host, port, _HANDSHAKE_KEY).encode()
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    socks = [socket.socket(family) for _ in range(connections)]
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        for sock in socks:
+            sock.setblocking(False)
+        gc.collect()
+        before = tracemalloc.take_snapshot()
+        for sock in socks:
+            await loop.sock_connect(sock, (host, port))
+            await loop.sock_sendall(sock, request)
+            response = await loop.sock_recv(sock, 4096)
+            if not response.startswith(b"HTTP/1.1 101"):
+                raise ConnectionError(
+                    "Websocket handshake failed: {!r}".format(
+                        response.split(b"\r\n", 1)[0]
+                    )
+                )
+            response = None
+        await asyncio.sleep(settle)
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+        for sock in socks:
+            sock.close()
+
+    stats = after.compare_to(before, "filename")
+    return sum(stat.size_diff for stat in stats) / connections
+
+
+async def handle_registry_summary(request: web.Request) -> web.Response:
+    """
+    Admin view that responds with the registry's summary as JSON.
+    """
+    summary = await request.app[REGISTRY_KEY].summary()
+    for oldest in summary["oldest"]:
+        oldest["session_ws_id"] = str(oldest["session_ws_id"])
+    return web.json_response(summary)
+
+
+def setup(
+    app: web.Application,
+    registry: SessionWSRegistry,
+    *,
+    admin_path: Optional[str] = None,
+    drain_options: Optional[Dict[str, Any]] = None,
+    handoff_path: Optional[str] = None
+) -> None:
     """
     Adds the registry to the applicati, as well as an on_shutdown hook that
     tears down all websockets on application shutdown.
+
+    If ``admin_path`` is provided, a GET route serving the registry's summary
+    is added at that path (protect it as you would any admin route).
+
+    If ``drain_options`` are provided, the registry is drained (see
+    `SessionWSRegistry.drain`) with them on shutdown, rather than closed.
+    If ``handoff_path`` is provided, the application listens there for
+    session states handed off by a draining worker while it runs.
     """
 
     async def on_shutdown(app: web.Application) -> None:
-        await app[REGISTRY_KEY].close_all()
+        if drain_options is not None:
+            await app[REGISTRY_KEY].drain(**drain_options)
+        else:
+            await app[REGISTRY_KEY].close_all()
+
+    async def on_startup(app: web.Application) -> None:
+        app[HANDOFF_SERVER_KEY] = await app[REGISTRY_KEY].serve_handoff(
+            handoff_path
+        )
+
+    async def on_cleanup(app: web.Application) -> None:
+        app[HANDOFF_SERVER_KEY].close()
+        await app[HANDOFF_SERVER_KEY].wait_closed()
 
     app[REGISTRY_KEY] = registry
     app.on_shutdown.append(on_shutdown)
+    if admin_path is not None:
+        app.router.add_get(admin_path, handle_registry_summary)
+    if handoff_path is not None:
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+
+
+def _nbytes(data: Union[str, bytes, bytearray, memoryview]) -> int:
+    """
+    The size of a message's data on the wire (UTF-8 encoded, if text).
+    """
+    if isinstance(data, str):
+        return len(data.encode())
+    if isinstance(data, memoryview):
+        return data.nbytes
+    return len(data)
+
+
+class _AccountedWebSocketResponse(web.WebSocketResponse):
+    """
+    A WebSocketResponse that counts the data messages it sends and receives
+    (`send_json` sends through `send_str`).
+    """
+
+    def __init__(self, traffic: TrafficAccounting, **options: Any) -> None:
+        super().__init__(**options)
+        self.traffic = traffic
+        self.session_ws_id = None  # type: Hashable
+
+    async def receive(self, timeout: Optional[float] = None) -> WSMessage:
+        msg = await super().receive(timeout)
+        if msg.type in _DATA_MSG_TYPES:
+            self.traffic.record_in(self.session_ws_id, 1, _nbytes(msg.data))
+        return msg
+
+    async def send_str(
+        self, data: str, compress: Optional[bool] = None
+    ) -> None:
+        await super().send_str(data, compress=compress)
+        self.traffic.record_out(self.session_ws_id, 1, _nbytes(data))
+
+    async def send_bytes(
+        self,
+        data: Union[bytes, bytearray, memoryview],
+        compress: Optional[bool] = None,
+    ) -> None:
+        await super().send_bytes(data, compress=compress)
+        self.traffic.record_out(self.session_ws_id, 1, _nbytes(data))
 
 
 class session_ws:  # pylint: disable=C0103, invalid-name
@@ -215,37 +1441,156 @@ class session_ws:  # pylint: disable=C0103, invalid-name
 
     :param request: the aiohttp.web.Request to upgrade to websockets
     :param options: constructor options for to aiohttp.web.WebSocketResponse
+        (in low-memory mode, defaulting to `LOW_MEMORY_WS_OPTIONS`)
     """
 
+    __slots__ = ("request", "options", "response", "session_ws_id", "_traces")
+
     def __init__(self, request: web.Request, **options: Dict[str, Any]) -> None:
         self.request = request
         self.options = options
         self.response = None  # type: Optional[web.WebSocketResponse]
         self.session_ws_id = None  # type: Hashable
+        self._traces = _NO_TRACES  # type: Tuple[_Trace, ...]
 
     @property
     def registry(self) -> SessionWSRegistry:
         return self.request.app[REGISTRY_KEY]
 
+    async def _send_stage_start(self, stage: str) -> None:
+        for trace in self._traces:
+            await trace.send_stage_start(
+                stage, self.request, self.session_ws_id
+            )
+
+    async def _send_stage_end(self, stage: str) -> None:
+        for trace in self._traces:
+            await trace.send_stage_end(stage, self.request, self.session_ws_id)
+
     async def __aenter__(self) -> web.WebSocketResponse:
-        self.response = web.WebSocketResponse(**self.options)
+        registry = self.registry
+        if registry.draining:
+            raise web.HTTPServiceUnavailable()
+
+        options = self.options
+        if registry.low_memory:
+            options = dict(LOW_MEMORY_WS_OPTIONS, **options)
+        if registry.traffic is not None:
+            self.response = _AccountedWebSocketResponse(
+                registry.traffic, **options
+            )
+        else:
+            self.response = web.WebSocketResponse(**options)
 
+        if registry.trace_configs:
+            self._traces = registry.make_traces()
+        traces = self._traces
+        for trace in traces:
+            await trace.send_upgrade_start(self.request, None, self.response)
+
+        try:
+            await self._upgrade(registry, traces)
+        except BaseException as exc:
+            for trace in traces:
+                await trace.send_upgrade_exception(
+                    self.request, self.session_ws_id, self.response, exc
+                )
+            raise
+
+        for trace in traces:
+            await trace.send_upgrade_end(
+                self.request, self.session_ws_id, self.response
+            )
+        return self.response
+
+    async def _upgrade(
+        self, registry: SessionWSRegistry, traces: Tuple[_Trace, ...]
+    ) -> None:
+        if traces:
+            await self._send_stage_start(STAGE_SESSION_LOAD)
         self.session_ws_id = await get_session_ws_id(self.request)
+        if traces:
+            await self._send_stage_end(STAGE_SESSION_LOAD)
+
         if self.session_ws_id is None:
+            if traces:
+                await self._send_stage_start(STAGE_GENERATE_ID)
             await new_session_ws_id(self.request)
             self.session_ws_id = await get_session_ws_id(self.request)
+            if traces:
+                await self._send_stage_end(STAGE_GENERATE_ID)
 
         session = await aiohttp_session.get_session(self.request)
         if session._changed:
+            if traces:
+                await self._send_stage_start(STAGE_SAVE_SESSION)
             storage = self.request[aiohttp_session.STORAGE_KEY]
             await storage.save_session(self.request, self.response, session)
+            if traces:
+                await self._send_stage_end(STAGE_SAVE_SESSION)
+
+        if traces:
+            await self._send_stage_start(STAGE_REGISTER)
+        self.session_ws_id = registry.register(
+            self.session_ws_id, self.response
+        )
+        if isinstance(self.response, _AccountedWebSocketResponse):
+            self.response.session_ws_id = self.session_ws_id
+        if traces:
+            await self._send_stage_end(STAGE_REGISTER)
 
-        self.registry.register(self.session_ws_id, self.response)
+        if traces:
+            await self._send_stage_start(STAGE_PREPARE)
         # send the session cookie along (if new)
         await self.response.prepare(self.request)
+        if traces:
+            await self._send_stage_end(STAGE_PREPARE)
 
-        return self.response
+    async def receive_many(
+        self,
+        max: int = DEFAULT_RECEIVE_MANY_MAX,
+        *,
+        timeout: Optional[float] = None
+    ) -> List[WSMessage]:
+        """
+        Receive a message, along with the data messages that are already
+        buffered (up to ``max`` in total), without waiting on the event loop
+        for each. The batch stops short of a buffered control frame (e.g. a
+        PING), which is handled by the next call.
+
+        A closing message (e.g. ``WSMsgType.CLOSE``) is always the last in its
+        batch.
+        """
+        # pylint: disable=W0622, redefined-builtin
+        wsr = self.response
+        messages = [await wsr.receive(timeout)]
+        while (
+            len(messages) < max
+            and messages[-1].type not in _CLOSING_MSG_TYPES
+            and _has_buffered_data(wsr)
+        ):
+            messages.append(await wsr.receive())
+        return messages
+
+    def batches(
+        self,
+        max: int = DEFAULT_RECEIVE_MANY_MAX,
+        *,
+        decoder: Optional[Callable[[List[WSMessage]], Any]] = None,
+        timeout: Optional[float] = None
+    ) -> _BatchIterator:
+        """
+        Iterate over batches of messages (see `receive_many`) until the
+        websocket closes. If provided, ``decoder`` is called with each batch,
+        and its result is yielded instead (see `decode_json_batch`).
+        """
+        # pylint: disable=W0622, redefined-builtin
+        return _BatchIterator(self, max, decoder, timeout)
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
         # pylint: disable=C0103, invalid-name
+        if self._traces:
+            await self._send_stage_start(STAGE_UNREGISTER)
         self.registry.unregister(self.session_ws_id, self.response)
+        if self._traces:
+            await self._send_stage_end(STAGE_UNREGISTER)
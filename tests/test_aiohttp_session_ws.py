@@ -1,22 +1,46 @@
 import asyncio
+import collections
 import json
+import os
 import time
 from unittest.mock import Mock
 import uuid
 
-from aiohttp import CookieJar, WSMessage, WSMsgType, web
+from aiohttp import (
+    CookieJar,
+    WSCloseCode,
+    WSMessage,
+    WSMsgType,
+    WSServerHandshakeError,
+    web,
+)
 from aiohttp.test_utils import make_mocked_request
 import aiohttp_session
 import pytest
 
 from aiohttp_session_ws import (
     DEFAULT_SESSION_KEY,
+    HANDOFF_SERVER_KEY,
+    PRIORITY_BULK,
+    PRIORITY_CONTROL,
+    PRIORITY_NORMAL,
     REGISTRY_KEY,
+    STAGE_GENERATE_ID,
+    STAGE_PREPARE,
+    STAGE_REGISTER,
+    STAGE_SAVE_SESSION,
+    STAGE_SESSION_LOAD,
+    STAGE_UNREGISTER,
     SessionWSRegistry,
+    SessionWSTraceConfig,
+    SlowUpgradeSampler,
+    TrafficAccounting,
     __version__,
+    decode_json_batch,
     delete_session_ws_id,
     ensure_session_ws_id,
     get_session_ws_id,
+    measure_idle_websockets,
     new_session_ws_id,
     schedule_close_all_session_ws,
     session_ws,
@@ -33,6 +57,41 @@ def make_mock_wsr():
     return Mock(spec=web.WebSocketResponse)
 
 
+def make_recording_wsr(sent, name=None):
+    """
+    A mock wsr that appends (name, method, data) to ``sent`` on send
+    """
+    wsr = make_mock_wsr()
+    wsr.closed = False
+
+    def make_send(method):
+        async def send(data):
+            sent.append((name, method, data))
+
+        return send
+
+    wsr.send_str = make_send("send_str")
+    wsr.send_bytes = make_send("send_bytes")
+    wsr.send_json = make_send("send_json")
+    return wsr
+
+
+def make_recording_trace_config(events):
+    """
+    A trace config that appends (signal, params) to ``events``
+    """
+    trace_config = SessionWSTraceConfig()
+    for name in dir(trace_config):
+        if name.startswith("on_"):
+
+            async def receiver(registry, ctx, params, name=name):
+                # pylint: disable=W0613, unused-argument
+                events.append((name, params))
+
+            getattr(trace_config, name).append(receiver)
+    return trace_config
+
+
 @pytest.fixture
 def async_mock_call():
     async def async_mock_call_(*args, **kwargs):
@@ -142,6 +201,64 @@ async def test_setup(registry, async_mock_call):
     registry.close_all.assert_called_once_with()
 
 
+@pytest.mark.asyncio
+async def test_setup_drain_options(registry, async_mock_call):
+    registry.drain = Mock(side_effect=async_mock_call)
+    registry.close_all = Mock(side_effect=async_mock_call)
+    app = web.Application()
+    setup_session_ws(app, registry, drain_options={"resume": "next"})
+    app.freeze()
+
+    await app.shutdown()
+    registry.drain.assert_called_once_with(resume="next")
+    registry.close_all.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_setup_handoff_path(registry, tmp_path):
+    app = web.Application()
+    setup_session_ws(app, registry, handoff_path=str(tmp_path / "handoff"))
+    app.freeze()
+
+    await app.startup()
+    server = app[HANDOFF_SERVER_KEY]
+    assert server.sockets
+
+    await app.cleanup()
+    assert not server.sockets
+
+
+@pytest.mark.parametrize(
+    ("admin_path",),
+    [pytest.param(None, id="none"), pytest.param("/_ws", id="set")],
+)
+def test_setup_admin_path(registry, admin_path):
+    app = web.Application()
+    setup_session_ws(app, registry, admin_path=admin_path)
+    paths = [resource.canonical for resource in app.router.resources()]
+    assert paths == ([admin_path] if admin_path else [])
+
+
+class TestRegistrySummaryView:
+    @pytest.fixture
+    def app(self):
+        app = web.Application()
+        setup_session_ws(app, SessionWSRegistry(), admin_path="/_ws")
+        return app
+
+    @pytest.mark.asyncio
+    async def test_view(self, app, client):
+        app[REGISTRY_KEY].register(uuid.UUID(int=0), make_mock_wsr())
+        resp = await client.get("/_ws")
+        assert resp.status == 200
+
+        data = await resp.json()
+        assert data["sessions"] == 1
+        assert data["sockets"] == 1
+        assert data["histogram"] == {"1": 1}
+        assert data["oldest"][0]["session_ws_id"] == str(uuid.UUID(int=0))
+
+
 COOKIE_NAME = "AIOHTTP_SESSION_WEBSOCKET"
 
 
@@ -163,6 +280,33 @@ class TestSessionWS:
                     await wsr.send_str(str(session_ws_id))
                 return wsr
 
+        async def handle_receive_many(request):
+            sws = session_ws(request)
+            async with sws as wsr:
+                while True:
+                    batch = await sws.receive_many()
+                    if batch[-1].type != WSMsgType.TEXT:
+                        break
+                    await wsr.send_json([msg.data for msg in batch])
+                return wsr
+
+        async def handle_buffered(request):
+            sws = session_ws(request)
+            async with sws as wsr:
+                await asyncio.sleep(.1)  # let the client's messages buffer
+                request.app["buffered"] = list(wsr._reader._buffer)
+                batch = await sws.receive_many()
+                await wsr.send_json([msg.data for msg in batch])
+                await wsr.receive()
+                return wsr
+
+        async def handle_batches(request):
+            sws = session_ws(request)
+            async with sws as wsr:
+                async for batch in sws.batches(decoder=decode_json_batch):
+                    request.app["received"].extend(batch)
+                return wsr
+
         app = web.Application(
             middlewares=[
                 aiohttp_session.session_middleware(
@@ -171,10 +315,93 @@ class TestSessionWS:
             ]
         )
         app.router.add_get("/ws", handle_websocket)
+        app.router.add_get("/batches", handle_batches)
+        app.router.add_get("/receive_many", handle_receive_many)
+        app.router.add_get("/buffered", handle_buffered)
+        app["received"] = []
 
         setup_session_ws(app, SessionWSRegistry())
         return app
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        ("path",),
+        [
+            pytest.param("/ws", id="receive"),
+            pytest.param("/batches", id="batches"),
+        ],
+    )
+    async def test_traffic(self, app, client, path):
+        traffic = app[REGISTRY_KEY].traffic = TrafficAccounting()
+        wsr = await client.ws_connect(path)
+        session_ws_id = get_session_data(wsr._response)[DEFAULT_SESSION_KEY]
+        await wsr.send_str("12")
+        await wsr.ping()
+        await wsr.send_bytes(b"345")
+        await wsr.close()
+
+        (top,) = traffic.top()
+        assert top["session_ws_id"] == session_ws_id
+        assert (top["messages_in"], top["bytes_in"]) == (2, 5)
+
+    @pytest.mark.asyncio
+    async def test_traffic_sent(self, app, client):
+        registry = app[REGISTRY_KEY]
+        traffic = registry.traffic = TrafficAccounting()
+        wsr = await client.ws_connect("/ws")
+        session_ws_id = get_session_data(wsr._response)[DEFAULT_SESSION_KEY]
+        await wsr.send_str("\u00e9")
+        assert await wsr.receive_str(timeout=1) == session_ws_id
+        registry.schedule_send(session_ws_id, b"345")
+        registry.schedule_send(session_ws_id, {"a": "\u00e9"})
+        assert await wsr.receive_bytes(timeout=1) == b"345"
+        assert await wsr.receive_json(timeout=1) == {"a": "\u00e9"}
+        await wsr.close()
+
+        (top,) = traffic.top()
+        assert (top["messages_in"], top["bytes_in"]) == (1, 2)
+        assert top["messages_out"] == 3
+        assert top["bytes_out"] == (
+            len(session_ws_id) + 3 + len(json.dumps({"a": "\u00e9"}))
+        )
+
+    @pytest.mark.asyncio
+    async def test_receive_many_with_ping(self, client):
+        wsr = await client.ws_connect("/receive_many")
+        await wsr.send_str("a")
+        await wsr.ping()
+        assert await wsr.receive_json(timeout=1) == ["a"]
+
+        await wsr.send_str("b")
+        assert await wsr.receive_json(timeout=1) == ["b"]
+        await wsr.close()
+
+    @pytest.mark.asyncio
+    async def test_receive_many_buffered(self, app, client):
+        """
+        receive_many relies on the layout of aiohttp's (private) reader buffer
+        """
+        wsr = await client.ws_connect("/buffered")
+        for data in "abc":
+            await wsr.send_str(data)
+        assert await wsr.receive_json(timeout=1) == ["a", "b", "c"]
+        await wsr.close()
+
+        buffered = app["buffered"]
+        assert len(buffered) == 3
+        for msg, size in buffered:
+            assert isinstance(msg, WSMessage)
+            assert msg.type == WSMsgType.TEXT
+            assert isinstance(size, int)
+
+    @pytest.mark.asyncio
+    async def test_batches(self, app, client):
+        wsr = await client.ws_connect("/batches")
+        for i in range(5):
+            await wsr.send_json(i)
+        await wsr.close()
+        assert app["received"] == list(range(5))
+
     @pytest.mark.asyncio
     async def test_without_session(self, app, client):
         wsr = await client.ws_connect("/ws")
@@ -210,6 +437,232 @@ class TestSessionWS:
         await wsr.close()
         assert data[DEFAULT_SESSION_KEY] not in app[REGISTRY_KEY]
 
+    @pytest.mark.asyncio
+    async def test_low_memory(self, app, client):
+        app[REGISTRY_KEY].low_memory = True
+        wsr = await client.ws_connect("/ws")
+        session_ws_id = get_session_data(wsr._response)[DEFAULT_SESSION_KEY]
+
+        (registered,) = app[REGISTRY_KEY][session_ws_id]
+        assert not registered.compress
+        await wsr.close()
+
+    @pytest.mark.asyncio
+    async def test_measure_idle_websockets(self, app, client):
+        per_socket = await measure_idle_websockets(
+            client.server.host, client.server.port, "/ws", connections=5
+        )
+        assert per_socket > 0
+        assert per_socket > (await app[REGISTRY_KEY].footprint())[
+            "shallow_bytes_per_socket"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_measure_idle_websockets_failed(self, client):
+        with pytest.raises(ConnectionError):
+            await measure_idle_websockets(
+                client.server.host, client.server.port, "/missing"
+            )
+
+    @pytest.mark.asyncio
+    async def test_trace_disabled(self, app, client):
+        registry = app[REGISTRY_KEY]
+        registry.make_traces = Mock(side_effect=AssertionError)
+        wsr = await client.ws_connect("/ws")
+        session_ws_id = get_session_data(wsr._response)[DEFAULT_SESSION_KEY]
+        await registry.close_all_session(session_ws_id)
+        await wsr.close()
+        await asyncio.sleep(.01)
+        assert not registry
+
+    @pytest.mark.asyncio
+    async def test_trace(self, app, client):
+        events = []
+        app[REGISTRY_KEY].trace_configs = [make_recording_trace_config(events)]
+        wsr = await client.ws_connect("/ws")
+        session_ws_id = get_session_data(wsr._response)[DEFAULT_SESSION_KEY]
+        await wsr.close()
+        await asyncio.sleep(.01)
+
+        assert [
+            (name, params.stage, params.session_ws_id)
+            if name.startswith("on_stage")
+            else (name, params.session_ws_id)
+            for name, params in events
+        ] == [
+            ("on_upgrade_start", None),
+            ("on_stage_start", STAGE_SESSION_LOAD, None),
+            ("on_stage_end", STAGE_SESSION_LOAD, None),
+            ("on_stage_start", STAGE_GENERATE_ID, None),
+            ("on_stage_end", STAGE_GENERATE_ID, session_ws_id),
+            ("on_stage_start", STAGE_SAVE_SESSION, session_ws_id),
+            ("on_stage_end", STAGE_SAVE_SESSION, session_ws_id),
+            ("on_stage_start", STAGE_REGISTER, session_ws_id),
+            ("on_stage_end", STAGE_REGISTER, session_ws_id),
+            ("on_stage_start", STAGE_PREPARE, session_ws_id),
+            ("on_stage_end", STAGE_PREPARE, session_ws_id),
+            ("on_upgrade_end", session_ws_id),
+            ("on_stage_start", STAGE_UNREGISTER, session_ws_id),
+            ("on_stage_end", STAGE_UNREGISTER, session_ws_id),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_draining(self, app, client):
+        app[REGISTRY_KEY].draining = True
+        with pytest.raises(WSServerHandshakeError) as exc_info:
+            await client.ws_connect("/ws")
+        assert exc_info.value.status == 503
+        assert not app[REGISTRY_KEY]
+
+    @pytest.mark.asyncio
+    async def test_trace_exception(self, registry, req):
+        events = []
+        registry.trace_configs = [make_recording_trace_config(events)]
+        error = RuntimeError("failed")
+        registry.get_id = Mock(side_effect=error)
+
+        with pytest.raises(RuntimeError):
+            await session_ws(req).__aenter__()
+        assert [name for name, params in events] == [
+            "on_upgrade_start",
+            "on_stage_start",
+            "on_upgrade_exception",
+        ]
+        assert events[-1][1].exception is error
+
+    def test_slots(self, req):
+        with pytest.raises(AttributeError):
+            session_ws(req).unknown = None
+
+
+class TestSessionWSReceive:
+    @staticmethod
+    def make_session_ws(req, buffered):
+        """
+        A session_ws whose (mock) response has ``buffered`` messages
+        """
+        sws = session_ws(req)
+        sws.response = make_mock_wsr()
+        sws.response._reader = Mock(
+            _buffer=collections.deque((msg, 0) for msg in buffered)
+        )
+
+        async def receive(timeout=None):  # pylint: disable=W0613
+            return sws.response._reader._buffer.popleft()[0]
+
+        sws.response.receive = receive
+        return sws
+
+    @staticmethod
+    def make_messages(*data):
+        return [WSMessage(WSMsgType.TEXT, d, None) for d in data]
+
+    @pytest.mark.asyncio
+    async def test_receive_many(self, req):
+        messages = self.make_messages("0", "1", "2")
+        sws = self.make_session_ws(req, list(messages))
+        assert await sws.receive_many() == messages
+
+    @pytest.mark.asyncio
+    async def test_receive_many_max(self, req):
+        messages = self.make_messages("0", "1", "2")
+        sws = self.make_session_ws(req, list(messages))
+        assert await sws.receive_many(2) == messages[:2]
+        assert await sws.receive_many(2) == messages[2:]
+
+    @pytest.mark.asyncio
+    async def test_receive_many_stops_on_close(self, req):
+        messages = self.make_messages("0")
+        messages.append(WSMessage(WSMsgType.CLOSE, 1000, None))
+        messages.extend(self.make_messages("1"))
+        sws = self.make_session_ws(req, list(messages))
+        assert await sws.receive_many() == messages[:1]
+        assert await sws.receive_many() == messages[1:2]
+
+    @pytest.mark.asyncio
+    async def test_receive_many_stops_at_control_frame(self, req):
+        messages = self.make_messages("0")
+        messages.append(WSMessage(WSMsgType.PING, b"", None))
+        messages.extend(self.make_messages("1"))
+        sws = self.make_session_ws(req, list(messages))
+        assert await sws.receive_many() == messages[:1]
+
+    @pytest.mark.asyncio
+    async def test_batches(self, req):
+        messages = self.make_messages("0", "1", "2")
+        messages.append(WSMessage(WSMsgType.CLOSED, None, None))
+        sws = self.make_session_ws(req, list(messages))
+
+        batches = []
+        async for batch in sws.batches(2):
+            batches.append(batch)
+        assert batches == [messages[:2], messages[2:3]]
+
+    @pytest.mark.asyncio
+    async def test_batches_closed(self, req):
+        sws = self.make_session_ws(
+            req, [WSMessage(WSMsgType.CLOSED, None, None)]
+        )
+        async for batch in sws.batches():
+            pytest.fail("Unexpected batch: {!r}".format(batch))
+
+    @pytest.mark.parametrize(
+        ("data",),
+        [pytest.param(["0"], id="after_batch"), pytest.param([], id="alone")],
+    )
+    @pytest.mark.asyncio
+    async def test_batches_error(self, req, data):
+        messages = self.make_messages(*data)
+        error = ConnectionResetError("reset")
+        messages.append(WSMessage(WSMsgType.ERROR, error, None))
+        sws = self.make_session_ws(req, list(messages))
+        sws.response.exception = Mock(return_value=error)
+
+        batches = []
+        with pytest.raises(ConnectionResetError):
+            async for batch in sws.batches():
+                batches.append(batch)
+        assert batches == ([messages[:1]] if data else [])
+
+    @pytest.mark.asyncio
+    async def test_batches_decoder(self, req):
+        messages = self.make_messages("0", '{"a": 1}')
+        sws = self.make_session_ws(req, list(messages))
+        batches = sws.batches(decoder=decode_json_batch)
+        assert await batches.__anext__() == [0, {"a": 1}]
+
+
+def test_decode_json_batch():
+    messages = [
+        WSMessage(WSMsgType.TEXT, "[0]", None),
+        WSMessage(WSMsgType.BINARY, b'"1"', None),
+    ]
+    assert decode_json_batch(messages) == [[0], "1"]
+
+
+@pytest.mark.parametrize(
+    ("data",),
+    [
+        pytest.param("1, 2", id="several_values"),
+        pytest.param("1],[2", id="structure"),
+        pytest.param("", id="empty"),
+        pytest.param("{", id="incomplete"),
+        pytest.param(b"\xff", id="non_utf8"),
+    ],
+)
+def test_decode_json_batch_invalid(data):
+    msg_type = WSMsgType.TEXT if isinstance(data, str) else WSMsgType.BINARY
+    messages = [
+        WSMessage(WSMsgType.TEXT, "[0", None),
+        WSMessage(msg_type, data, None),
+        WSMessage(WSMsgType.TEXT, "1]", None),
+        WSMessage(WSMsgType.TEXT, "2", None),
+    ]
+    decoded = decode_json_batch(messages)
+    assert len(decoded) == 4
+    assert all(isinstance(d, ValueError) for d in decoded[:3])
+    assert decoded[3] == 2
+
 
 class TestSessionWSRegistry:
     @staticmethod
@@ -330,6 +783,22 @@ class TestSessionWSRegistry:
         assert fut.done()
         assert not fut.exception()
 
+    @pytest.mark.asyncio
+    async def test_schedule_close_all_session_trace(self, registry):
+        events = []
+        registry.trace_configs = [make_recording_trace_config(events)]
+        # pylint: disable=W0612, unused-variable
+        request, session = self.make_request_session_tuple("dummy")
+        request._task = asyncio.ensure_future(asyncio.sleep(0))
+
+        await registry.schedule_close_all_session(request, Mock())
+        await asyncio.sleep(.01)
+        assert [(name, tuple(params)) for name, params in events] == [
+            ("on_schedule_close_all_session", (request, "dummy")),
+            ("on_close_all_session_start", ("dummy", 0)),
+            ("on_close_all_session_end", ("dummy", 0)),
+        ]
+
     @pytest.mark.asyncio
     async def test_close_all_session(self, registry, wsr):
         event = asyncio.Event()
@@ -343,9 +812,473 @@ class TestSessionWSRegistry:
         assert fut.done()
         assert not fut.exception()
 
+    @pytest.mark.asyncio
+    async def test_iter_snapshot(self, registry):
+        wsrs = [make_mock_wsr() for i in range(5)]
+        for i, wsr in enumerate(wsrs):
+            registry.register(i, wsr)
+
+        chunks = []
+        async for chunk in registry.iter_snapshot(chunk_size=2):
+            chunks.append(chunk)
+
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert dict(sum(chunks, [])) == {
+            i: frozenset([wsr]) for i, wsr in enumerate(wsrs)
+        }
+
+    @pytest.mark.asyncio
+    async def test_iter_snapshot_with_churn(self, registry):
+        wsrs = [make_mock_wsr() for i in range(4)]
+        for i, wsr in enumerate(wsrs):
+            registry.register(i, wsr)
+
+        snapshot = {}
+        async for chunk in registry.iter_snapshot(chunk_size=1):
+            snapshot.update(chunk)
+            # unregistering a session not yet visited, and registering a new
+            # one, must not raise
+            registry.unregister(3, wsrs[3])
+            registry.register(4, make_mock_wsr())
+
+        assert set(snapshot) == {0, 1, 2}
+
+    @pytest.mark.asyncio
+    async def test_snapshot(self, registry, wsr):
+        registry.register(0, wsr)
+        snapshot = await registry.snapshot()
+        assert snapshot == {0: frozenset([wsr])}
+
+        registry.unregister(0, wsr)
+        assert snapshot == {0: frozenset([wsr])}
+
+    @pytest.mark.asyncio
+    async def test_summary(self, registry):
+        wsrs = [make_mock_wsr() for i in range(4)]
+        registry.register(0, wsrs[0])
+        registry.register(1, wsrs[1])
+        registry.register(1, wsrs[2])
+        registry.register(2, wsrs[3])
+
+        summary = await registry.summary(chunk_size=1, oldest=2)
+        assert summary["sessions"] == 3
+        assert summary["sockets"] == 4
+        assert summary["histogram"] == {1: 2, 2: 1}
+        assert [o["session_ws_id"] for o in summary["oldest"]] == [0, 1]
+        assert all(o["age"] >= 0 for o in summary["oldest"])
+
+    @pytest.mark.asyncio
+    async def test_summary_empty(self, registry):
+        assert await registry.summary() == {
+            "sessions": 0,
+            "sockets": 0,
+            "histogram": {},
+            "oldest": [],
+        }
+
+    @pytest.mark.asyncio
+    async def test_schedule_send(self, registry):
+        sent = []
+        registry.register(0, make_recording_wsr(sent))
+        registry.schedule_send(0, "str")
+        registry.schedule_send(0, b"bytes")
+        registry.schedule_send(0, {"json": True})
+        registry.schedule_send(1, "missing")
+        await asyncio.sleep(.01)
+        assert sent == [
+            (None, "send_str", "str"),
+            (None, "send_bytes", b"bytes"),
+            (None, "send_json", {"json": True}),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_drain(self, registry):
+        closed = []
+        wsrs = [make_mock_wsr() for i in range(2)]
+        for i, wsr in enumerate(wsrs):
+
+            async def close(wsr=wsr, **kwargs):
+                closed.append((wsr, kwargs))
+
+            wsr.close = close
+            registry.register(i, wsr)
+        registry.schedule_send(0, "dropped")
+
+        await registry.drain(resume="worker-2")
+        assert registry.draining
+        assert not registry._scheduler
+        kwargs = {"code": WSCloseCode.SERVICE_RESTART, "message": b"worker-2"}
+        assert sorted(closed, key=lambda c: wsrs.index(c[0])) == [
+            (wsr, kwargs) for wsr in wsrs
+        ]
+
+    @pytest.mark.asyncio
+    async def test_drain_handoff_missing_successor(
+        self, registry, tmp_path, caplog
+    ):
+        wsr = make_mock_wsr()
+        wsr.close = Mock(side_effect=lambda **kwargs: asyncio.sleep(0))
+        registry.register("a", wsr)
+
+        await registry.drain(
+            handoff_path=str(tmp_path / "missing"), get_state=lambda id_: {}
+        )
+        assert registry.draining
+        assert "Failed to hand off session states" in caplog.text
+        wsr.close.assert_called_once_with(
+            code=WSCloseCode.SERVICE_RESTART, message=b""
+        )
+
+    @pytest.mark.asyncio
+    async def test_handoff_not_acknowledged(self, registry, tmp_path):
+        path = str(tmp_path / "handoff")
+
+        async def on_connection(reader, writer):
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_unix_server(on_connection, path)
+        with pytest.raises(ConnectionError):
+            await registry.handoff(path, {"a": {}})
+        server.close()
+        await server.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_drain_handoff_timeout(self, registry, tmp_path, caplog):
+        path = str(tmp_path / "handoff")
+        connected, release = asyncio.Event(), asyncio.Event()
+
+        async def on_connection(reader, writer):
+            # pylint: disable=W0613, unused-argument
+            connected.set()
+            await release.wait()  # never acknowledge
+            writer.close()
+
+        server = await asyncio.start_unix_server(on_connection, path)
+        wsr = make_mock_wsr()
+        wsr.close = Mock(side_effect=lambda **kwargs: asyncio.sleep(0))
+        registry.register("a", wsr)
+
+        await asyncio.wait_for(
+            registry.drain(
+                handoff_path=path,
+                get_state=lambda id_: {},
+                handoff_timeout=0.1,
+            ),
+            timeout=1,
+        )
+        assert connected.is_set()
+        assert "Failed to hand off session states" in caplog.text
+        wsr.close.assert_called_once_with(
+            code=WSCloseCode.SERVICE_RESTART, message=b""
+        )
+        release.set()
+        server.close()
+        await server.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_serve_handoff_invalid(self, registry, tmp_path, caplog):
+        path = str(tmp_path / "handoff")
+        server = await SessionWSRegistry().serve_handoff(path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b"not json\n")
+        writer.write_eof()
+        assert await reader.readline() == b""  # no acknowledgement
+        writer.close()
+        assert "Failed to receive handed off states" in caplog.text
+        server.close()
+        await server.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_serve_handoff_mode(self, registry, tmp_path):
+        path = str(tmp_path / "handoff")
+        umask = os.umask(0)
+        try:
+            server = await registry.serve_handoff(path)
+            assert os.umask(umask) == 0
+        finally:
+            os.umask(umask)
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        server.close()
+        await server.wait_closed()
+
+    def test_handoff_state_expiry(self, monkeypatch):
+        clock = Mock(return_value=0)
+        monkeypatch.setattr("aiohttp_session_ws.time.monotonic", clock)
+        registry = SessionWSRegistry(handoff_ttl=10)
+        registry._store_handoff_state("a", 1)
+        clock.return_value = 5
+        registry._store_handoff_state("b", 2)
+
+        clock.return_value = 10
+        assert registry.pop_handoff_state("a") is None
+        registry._store_handoff_state("c", 3)
+        assert list(registry._handoff_state) == ["b", "c"]
+        assert registry.pop_handoff_state("b") == 2
+
+    def test_handoff_state_max_states(self):
+        registry = SessionWSRegistry(handoff_max_states=2)
+        for i, session_ws_id in enumerate(["a", "b", "c"]):
+            registry._store_handoff_state(session_ws_id, i)
+        assert registry.pop_handoff_state("a") is None
+        assert registry.pop_handoff_state("b") == 1
+        assert registry.pop_handoff_state("c") == 2
+
+    @pytest.mark.asyncio
+    async def test_drain_resume_too_long(self, registry):
+        with pytest.raises(ValueError):
+            await registry.drain(resume="x" * 124)
+        assert not registry.draining
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        ("is_async",),
+        [pytest.param(False, id="sync"), pytest.param(True, id="async")],
+    )
+    async def test_drain_handoff(self, registry, tmp_path, is_async):
+        path = str(tmp_path / "handoff")
+        successor = SessionWSRegistry()
+        server = await successor.serve_handoff(path)
+
+        for session_ws_id in ["a", "b", "c"]:
+            wsr = make_mock_wsr()
+            wsr.close = Mock(side_effect=lambda **kwargs: asyncio.sleep(0))
+            registry.register(session_ws_id, wsr)
+
+        def get_state(session_ws_id):
+            return {"id": session_ws_id} if session_ws_id != "c" else None
+
+        async def get_state_async(session_ws_id):
+            return get_state(session_ws_id)
+
+        await registry.drain(
+            handoff_path=path,
+            get_state=get_state_async if is_async else get_state,
+        )
+        server.close()
+        await server.wait_closed()
+
+        assert successor.pop_handoff_state("a") == {"id": "a"}
+        assert successor.pop_handoff_state("a") is None
+        assert successor.pop_handoff_state("b") == {"id": "b"}
+        assert successor.pop_handoff_state("c", default=...) is ...
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_traffic_dropped(self):
+        traffic = TrafficAccounting()
+        registry = SessionWSRegistry(traffic=traffic)
+        wsr = make_recording_wsr([])
+        wsr.closed = True
+        registry.register(0, wsr)
+        registry.schedule_send(0, "first")
+        registry.schedule_send(0, "second")
+        await asyncio.sleep(.01)
+
+        (top,) = traffic.top()
+        assert (top["messages_out"], top["dropped"]) == (0, 2)
+
+    @pytest.mark.parametrize(
+        ("priority",),
+        [
+            pytest.param(PRIORITY_BULK + 1, id="out_of_range"),
+            pytest.param(1.5, id="float"),
+        ],
+    )
+    def test_schedule_send_unknown_priority(self, registry, priority):
+        with pytest.raises(ValueError):
+            registry.schedule_send(0, "data", priority=priority)
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_max_queued(self):
+        traffic = TrafficAccounting()
+        registry = SessionWSRegistry(traffic=traffic, max_queued=3)
+        sent = []
+        registry.register(0, make_recording_wsr(sent))
+        registry.schedule_send(0, "bulk-0", priority=PRIORITY_BULK)
+        registry.schedule_send(0, "bulk-1", priority=PRIORITY_BULK)
+        registry.schedule_send(0, "normal-0", priority=PRIORITY_NORMAL)
+        registry.schedule_send(0, "control-0", priority=PRIORITY_CONTROL)
+        registry.schedule_send(0, "control-1", priority=PRIORITY_CONTROL)
+        assert len(registry._scheduler) == 3
+
+        await asyncio.sleep(.01)
+        assert [data for _, _, data in sent] == [
+            "control-0",
+            "control-1",
+            "normal-0",
+        ]
+        (top,) = traffic.top()
+        assert top["dropped"] == 2
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_priority(self, registry):
+        sent = []
+        registry.register(0, make_recording_wsr(sent))
+        registry.schedule_send(0, "bulk", priority=PRIORITY_BULK)
+        registry.schedule_send(0, "normal", priority=PRIORITY_NORMAL)
+        registry.schedule_send(0, "control", priority=PRIORITY_CONTROL)
+        await asyncio.sleep(.01)
+        assert [data for _, _, data in sent] == ["control", "normal", "bulk"]
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_slow_socket(self, registry):
+        sent = []
+        event = asyncio.Event()
+        slow = make_recording_wsr(sent, "slow")
+
+        async def send_str(data):
+            await event.wait()
+            sent.append(("slow", "send_str", data))
+
+        slow.send_str = send_str
+        registry.register(0, slow)
+        registry.register(1, make_recording_wsr(sent, "fast"))
+        registry.schedule_send(0, "bulk", priority=PRIORITY_BULK)
+        registry.schedule_send(1, "control", priority=PRIORITY_CONTROL)
+        await asyncio.sleep(.01)
+        assert [(name, data) for name, _, data in sent] == [("fast", "control")]
+
+        event.set()
+        await asyncio.sleep(.01)
+        assert [(name, data) for name, _, data in sent] == [
+            ("fast", "control"),
+            ("slow", "bulk"),
+        ]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        ("traffic",),
+        [pytest.param(None, id="default"), pytest.param(True, id="traffic")],
+    )
+    async def test_schedule_send_bad_data(self, traffic, caplog):
+        traffic = TrafficAccounting() if traffic else None
+        registry = SessionWSRegistry(traffic=traffic)
+        sent = []
+        wsr = make_recording_wsr(sent)
+
+        async def send_json(data):
+            raise TypeError("not serializable")
+
+        wsr.send_json = send_json
+        registry.register(0, wsr)
+        registry.schedule_send(0, {"not", "serializable"})
+        registry.schedule_send(0, "ok")
+        await asyncio.sleep(.01)
+
+        assert sent == [(None, "send_str", "ok")]
+        assert "Failed to send to session_ws id 0" in caplog.text
+        assert not registry._scheduler._tasks
+        if traffic:
+            (top,) = traffic.top()
+            assert top["dropped"] == 1
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_skips_closed(self, registry):
+        sent = []
+        wsr = make_recording_wsr(sent)
+        wsr.closed = True
+        registry.register(0, wsr)
+        registry.schedule_send(0, "data")
+        await asyncio.sleep(.01)
+        assert sent == []
+        assert not registry._scheduler
+
+    @pytest.mark.asyncio
+    async def test_schedule_send_error_drops_queue(self, registry):
+        sent = []
+        wsr = make_recording_wsr(sent)
+
+        async def send_str(data):
+            raise ConnectionResetError()
+
+        wsr.send_str = send_str
+        registry.register(0, wsr)
+        registry.schedule_send(0, "first")
+        registry.schedule_send(0, "second")
+        await asyncio.sleep(.01)
+        assert not registry._scheduler
+
+    @pytest.mark.asyncio
+    async def test_close_all_session_drops_queue(self, registry):
+        sent = []
+        wsr = make_recording_wsr(sent)
+
+        async def close():
+            pass
+
+        wsr.close = close
+        registry.register(0, wsr)
+        for i in range(3):
+            registry.schedule_send(0, i, priority=PRIORITY_BULK)
+        assert len(registry._scheduler) == 3
+
+        await registry.close_all_session(0)
+        await asyncio.sleep(.01)
+        assert sent == []
+        assert not registry._scheduler
+
+    def test_unregister_drops_queue(self, registry):
+        wsr = make_recording_wsr([])
+        registry.register(0, wsr)
+        registry._scheduler._queues[wsr] = [collections.deque([0])]
+        registry.unregister(0, wsr)
+        assert not registry._scheduler
+
+    @pytest.mark.parametrize(
+        ("low_memory",),
+        [
+            pytest.param(True, id="low_memory"),
+            pytest.param(False, id="default"),
+        ],
+    )
+    def test_register_shares_id(self, low_memory):
+        registry = SessionWSRegistry(low_memory=low_memory)
+        first, second = "".join(["session", "-id"]), "".join(["session-", "id"])
+        wsrs = make_mock_wsr(), make_mock_wsr()
+        assert registry.register(first, wsrs[0]) is first
+        assert registry.register(second, wsrs[1]) is (
+            first if low_memory else second
+        )
+
+        for wsr in wsrs:
+            registry.unregister(first, wsr)
+        assert not registry._registry
+        assert not registry._ids
+
+    @pytest.mark.asyncio
+    async def test_footprint(self, registry):
+        assert (await registry.footprint())["shallow_bytes_per_socket"] == 0
+
+        registry.register(0, make_mock_wsr())
+        registry.register(0, make_mock_wsr())
+        footprint = await registry.footprint()
+        assert footprint["sockets"] == 2
+        assert footprint["registry_bytes"] > 0
+        assert footprint["shallow_wsr_bytes"] > 0
+        assert footprint["session_ws_bytes"] > 0
+        assert footprint["shallow_bytes_per_socket"] == (
+            footprint["registry_bytes"]
+            + footprint["shallow_wsr_bytes"]
+            + footprint["session_ws_bytes"]
+        ) / 2
+
+    @pytest.mark.asyncio
+    async def test_low_memory_registration(self, wsr):
+        registry = SessionWSRegistry(low_memory=True)
+        registry.register(0, wsr)
+        assert not registry._registered_at
+        assert (await registry.summary())["oldest"] == []
+
+        default = SessionWSRegistry()
+        default.register(0, wsr)
+        assert (await registry.footprint())["registry_bytes"] < (
+            await default.footprint()
+        )["registry_bytes"]
+
     def test_register(self, registry, wsr):
         registry.register(0, wsr)
         assert dict(registry) == {0: set([wsr])}
+        assert wsr in registry._registered_at
 
     def test_unregister_missing(self, registry, wsr):
         """
@@ -357,9 +1290,10 @@ class TestSessionWSRegistry:
         """
         Removes key-value pair from registry
         """
-        registry._registry[0] = set([wsr])
+        registry.register(0, wsr)
         registry.unregister(0, wsr)
         assert 0 not in registry
+        assert wsr not in registry._registered_at
 
     def test_unregister_not_last(self, wsr):
         """
@@ -372,6 +1306,151 @@ class TestSessionWSRegistry:
         assert registry.get(0) == set([wsr2])
 
 
+class TestTrafficAccounting:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        clock = Mock(return_value=0)
+        monkeypatch.setattr("aiohttp_session_ws.time.monotonic", clock)
+        return clock
+
+    def test_top(self, clock):
+        # pylint: disable=W0613, unused-argument
+        traffic = TrafficAccounting()
+        traffic.record_in("a", 1, 100)
+        traffic.record_out("b", 2, 10)
+        traffic.record_out("b", 2, 10)
+        traffic.record_in("c", 1, 50)
+        traffic.record_dropped("c", 3)
+
+        assert traffic.top(1) == [
+            {
+                "session_ws_id": "a",
+                "messages_in": 1,
+                "bytes_in": 100,
+                "messages_out": 0,
+                "bytes_out": 0,
+                "dropped": 0,
+                "error": 0,
+                "messages": 1,
+                "bytes": 100,
+            }
+        ]
+        top = traffic.top(metric="messages")
+        assert [total["session_ws_id"] for total in top] == ["b", "a", "c"]
+        top = traffic.top(2, "dropped")
+        assert [total["session_ws_id"] for total in top] == ["c", "a"]
+
+    def test_top_unknown_metric(self):
+        with pytest.raises(ValueError):
+            TrafficAccounting().top(metric="unknown")
+
+    def test_capacity(self, clock):
+        # pylint: disable=W0613, unused-argument
+        traffic = TrafficAccounting(capacity=2)
+        traffic.record_in("a", 1, 100)
+        traffic.record_in("b", 1, 10)
+        traffic.record_in("c", 1, 20)
+
+        top = traffic.top()
+        assert [total["session_ws_id"] for total in top] == ["a", "c"]
+        assert top[1]["error"] == 10
+
+    def test_capacity_heavy_hitter(self, clock):
+        # pylint: disable=W0613, unused-argument
+        traffic = TrafficAccounting(capacity=3)
+        for session_ws_id in ["x", "y", "z"]:
+            traffic.record_in(session_ws_id, 1, 1)
+        for i in range(50):
+            traffic.record_in("heavy", 1, 250)
+            traffic.record_in("new{}".format(i), 1, 1)
+
+        top = traffic.top(1)
+        assert top[0]["session_ws_id"] == "heavy"
+        assert top[0]["bytes_in"] == 50 * 250
+
+    def test_capacity_stale_heap(self, clock):
+        # pylint: disable=W0613, unused-argument
+        traffic = TrafficAccounting(capacity=2)
+        traffic.record_in("a", 1, 1)
+        traffic.record_in("b", 1, 2)
+        traffic.record_in("a", 1, 10)  # "a" is no longer the lightest
+        traffic.record_in("c", 1, 1)
+
+        top = traffic.top()
+        assert [total["session_ws_id"] for total in top] == ["a", "c"]
+        assert top[1]["error"] == 2
+
+    def test_buckets(self, clock):
+        traffic = TrafficAccounting(bucket_seconds=10, buckets=2)
+        traffic.record_in("a", 1, 100)
+        clock.return_value = 10
+        traffic.record_in("a", 1, 100)
+        traffic.record_in("b", 1, 150)
+        assert [t["bytes"] for t in traffic.top()] == [200, 150]
+
+        clock.return_value = 20
+        assert [t["bytes"] for t in traffic.top()] == [150, 100]
+
+        clock.return_value = 40
+        assert traffic.top() == []
+
+
+class TestSlowUpgradeSampler:
+    async def upgrade(self, sampler, duration):
+        ctx = sampler.trace_config.trace_config_ctx()
+        params = Mock(session_ws_id="dummy", stage=STAGE_PREPARE)
+        await sampler.on_upgrade_start(None, ctx, params)
+        await sampler.on_stage_start(None, ctx, params)
+        await asyncio.sleep(duration)
+        await sampler.on_stage_end(None, ctx, params)
+        await sampler.on_upgrade_end(None, ctx, params)
+
+    def test_trace_config(self):
+        sampler = SlowUpgradeSampler(1)
+        assert list(sampler.trace_config.on_upgrade_start) == [
+            sampler.on_upgrade_start
+        ]
+        assert list(sampler.trace_config.on_upgrade_end) == [
+            sampler.on_upgrade_end
+        ]
+
+    @pytest.mark.asyncio
+    async def test_slow(self):
+        log = Mock()
+        await self.upgrade(SlowUpgradeSampler(.01, log=log), .02)
+        log.warning.assert_called_once()
+        args = log.warning.call_args[0]
+        assert args[1] == "Slow session_ws upgrade"
+        assert args[2] >= .01
+        assert args[3] == "dummy"
+        assert args[4].startswith(STAGE_PREPARE + "=")
+
+    @pytest.mark.asyncio
+    async def test_slow_exception(self):
+        log = Mock()
+        sampler = SlowUpgradeSampler(.01, log=log)
+        ctx = sampler.trace_config.trace_config_ctx()
+        params = Mock(session_ws_id="dummy", stage=STAGE_PREPARE)
+        params.exception = RuntimeError("failed")
+        await sampler.on_upgrade_start(None, ctx, params)
+        await sampler.on_stage_start(None, ctx, params)
+        await asyncio.sleep(.02)
+        await sampler.on_upgrade_exception(None, ctx, params)
+
+        log.warning.assert_called_once()
+        args = log.warning.call_args[0]
+        assert args[1] == (
+            "Slow session_ws upgrade failed with RuntimeError('failed')"
+        )
+        assert args[4].startswith(STAGE_PREPARE + " (failed)=")
+
+    @pytest.mark.asyncio
+    async def test_fast(self):
+        log = Mock()
+        await self.upgrade(SlowUpgradeSampler(1, log=log), 0)
+        log.warning.assert_not_called()
+
+
 class TestIntegration:
     @pytest.fixture
     def app(self):